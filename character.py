@@ -0,0 +1,328 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from wcferry import Wcf, WxMsg
+from dice_roller import process_roll_command
+from functions import get_user_display_name
+
+logger = logging.getLogger(__name__)
+
+# 六项基础属性，检定时按 (属性值-10)//2 换算为调整值；其余条目（技能等）直接作为调整值
+ABILITY_NAMES = ('力量', '敏捷', '体质', '智力', '感知', '魅力')
+
+# 属性名 + 数值，例如：力量16 敏捷14 运动+5
+ATTR_PATTERN = re.compile(r'([^\d\s+\-:：=]+)\s*[:：=]?\s*([+-]?\d+)')
+
+# 检定表达式：属性名[+-调整值] [a/p]
+CHECK_PATTERN = re.compile(r'^(\S+?)\s*([+-]\d+)?(?:\s+([ap]))?$')
+
+class CharacterSheet:
+    """角色卡记录"""
+
+    __slots__ = ('room_id', 'wxid', 'attrs')
+
+    def __init__(self, room_id: str, wxid: str, attrs: Dict[str, int] = None):
+        self.room_id = room_id
+        self.wxid = wxid
+        self.attrs = attrs if attrs is not None else {}
+
+    def get_modifier(self, name: str) -> Optional[int]:
+        """获取属性对应的检定调整值"""
+        value = self.attrs.get(name)
+        if value is None:
+            return None
+        if name in ABILITY_NAMES:
+            return (value - 10) // 2
+        return value
+
+class CharacterStore:
+    """角色卡存储：内存LRU缓存 + 后台线程批量写回SQLite"""
+
+    def __init__(self, db_path: str, max_cached: int = 1000, flush_interval: float = 2.0):
+        self.db_path = db_path
+        self.max_cached = max_cached
+        self.flush_interval = flush_interval
+
+        self._sheets: "OrderedDict[Tuple[str, str], CharacterSheet]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}  # 待写回的数据，None表示删除
+        self._flushing: Dict[Tuple[str, str], Optional[str]] = {}  # 正在写入数据库的批次
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()  # 保护读连接，磁盘读取不占用 _lock
+        self._flush_count = 0  # 每完成一次写回加一，用于判断读取期间数据库是否有变化
+        self._stopped = threading.Event()
+
+        self._init_db()
+        self._read_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._writer = threading.Thread(target=self._writer_loop, name="character-writer", daemon=True)
+        self._writer.start()
+
+    def _init_db(self) -> None:
+        """初始化数据库表结构"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS characters ("
+                    "room_id TEXT NOT NULL, wxid TEXT NOT NULL, attrs TEXT NOT NULL, "
+                    "updated_at REAL NOT NULL, PRIMARY KEY (room_id, wxid))"
+                )
+        finally:
+            conn.close()
+
+    def get(self, room_id: str, wxid: str) -> CharacterSheet:
+        """获取角色卡，首次访问时从数据库懒加载"""
+        key = (room_id or "", wxid)
+        while True:
+            with self._lock:
+                sheet = self._get_in_memory(key)
+                if sheet is not None:
+                    return sheet
+                flush_count = self._flush_count
+
+            # 在锁外读取数据库，冷加载不阻塞其他角色卡的访问和写回线程
+            attrs = self._load_attrs(key)
+
+            with self._lock:
+                # 读取期间其他线程可能已加载或修改了该角色卡
+                sheet = self._get_in_memory(key)
+                if sheet is not None:
+                    return sheet
+                if flush_count != self._flush_count:
+                    # 读取期间发生过写回，读到的可能是旧数据，重新读取
+                    continue
+                return self._insert(key, attrs)
+
+    def _get_in_memory(self, key: Tuple[str, str]) -> Optional[CharacterSheet]:
+        """从缓存或待写回数据中获取角色卡（调用方需持有锁）"""
+        sheet = self._sheets.get(key)
+        if sheet is not None:
+            self._sheets.move_to_end(key)
+            return sheet
+
+        if key in self._pending or key in self._flushing:
+            # 尚未写回的数据以内存为准，无需访问磁盘
+            data = self._pending[key] if key in self._pending else self._flushing[key]
+            return self._insert(key, json.loads(data) if data else {})
+        return None
+
+    def _insert(self, key: Tuple[str, str], attrs: Dict[str, int]) -> CharacterSheet:
+        """将角色卡放入缓存（调用方需持有锁）"""
+        sheet = CharacterSheet(key[0], key[1], attrs)
+        self._sheets[key] = sheet
+        self._evict()
+        return sheet
+
+    def update(self, sheet: CharacterSheet, attrs: Dict[str, int]) -> None:
+        """更新角色卡属性并登记写回"""
+        with self._lock:
+            sheet.attrs.update(attrs)
+            self._pending[(sheet.room_id, sheet.wxid)] = json.dumps(sheet.attrs, ensure_ascii=False)
+
+    def clear(self, sheet: CharacterSheet) -> None:
+        """清空角色卡并登记删除"""
+        with self._lock:
+            sheet.attrs.clear()
+            self._pending[(sheet.room_id, sheet.wxid)] = None
+
+    def _load_attrs(self, key: Tuple[str, str]) -> Dict[str, int]:
+        """从数据库读取角色卡属性"""
+        try:
+            with self._read_lock:
+                row = self._read_conn.execute(
+                    "SELECT attrs FROM characters WHERE room_id = ? AND wxid = ?", key
+                ).fetchone()
+            return json.loads(row[0]) if row else {}
+        except Exception as e:
+            logger.error(f"读取角色卡出错: {e}", exc_info=True)
+            return {}
+
+    def _evict(self) -> None:
+        """淘汰最久未访问的角色卡（调用方需持有锁）"""
+        while len(self._sheets) > self.max_cached:
+            # 未写回的修改保存在 _pending 中，淘汰后不会丢失
+            self._sheets.popitem(last=False)
+
+    def _writer_loop(self) -> None:
+        """后台写回线程"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # 按固定间隔批量写回，合并同一角色卡的连续修改
+            while not self._stopped.wait(self.flush_interval):
+                self._flush(conn)
+            self._flush(conn)
+        finally:
+            conn.close()
+
+    def _flush(self, conn: sqlite3.Connection) -> None:
+        """将待写回的数据批量写入数据库"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            self._flushing = batch
+
+        now = time.time()
+        upserts = [(room_id, wxid, data, now) for (room_id, wxid), data in batch.items() if data]
+        deletes = [key for key, data in batch.items() if not data]
+        try:
+            with conn:
+                if upserts:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO characters (room_id, wxid, attrs, updated_at) VALUES (?, ?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM characters WHERE room_id = ? AND wxid = ?", deletes)
+            logger.debug(f"角色卡写回完成: 更新{len(upserts)}条, 删除{len(deletes)}条")
+        except Exception as e:
+            logger.error(f"角色卡写回出错: {e}", exc_info=True)
+            # 写回失败时放回队列，保留期间产生的更新的修改
+            with self._lock:
+                for key, data in batch.items():
+                    self._pending.setdefault(key, data)
+        finally:
+            with self._lock:
+                self._flushing = {}
+                self._flush_count += 1
+
+    def close(self) -> None:
+        """停止写回线程并写入剩余数据"""
+        self._stopped.set()
+        self._writer.join()
+        self._read_conn.close()
+
+# 全局角色卡存储，首次使用时根据配置创建
+_store: Optional[CharacterStore] = None
+_store_lock = threading.Lock()
+
+def get_character_store(config: dict) -> CharacterStore:
+    """获取全局角色卡存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            char_config = config.get('character', {})
+            db_file = config.get('files', {}).get('character_db', 'characters.db')
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            _store = CharacterStore(
+                os.path.join(current_dir, db_file),
+                max_cached=char_config.get('max_cached', 1000),
+                flush_interval=char_config.get('flush_interval', 2.0)
+            )
+        return _store
+
+def close_character_store() -> None:
+    """关闭全局角色卡存储"""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+def parse_attributes(text: str) -> Dict[str, int]:
+    """解析属性录入文本"""
+    return {name: int(value) for name, value in ATTR_PATTERN.findall(text)}
+
+def format_value(name: str, value: int) -> str:
+    """格式化属性值：属性值原样显示，技能等调整值保留正负号"""
+    if name in ABILITY_NAMES:
+        return str(value)
+    return f"{'+' if value >= 0 else ''}{value}"
+
+def format_sheet(nickname: str, sheet: CharacterSheet) -> str:
+    """格式化角色卡内容"""
+    if not sheet.attrs:
+        return f"【{nickname}】尚未录入属性，例如：.st 力量16 敏捷14"
+
+    lines = []
+    for name, value in sheet.attrs.items():
+        if name in ABILITY_NAMES:
+            mod = sheet.get_modifier(name)
+            lines.append(f"{name}: {value} ({'+' if mod >= 0 else ''}{mod})")
+        else:
+            lines.append(f"{name}: {format_value(name, value)}")
+    return f"【{nickname}】的角色卡：\n" + "\n".join(lines)
+
+def build_check_expression(sheet: CharacterSheet, text: str) -> Tuple[Optional[str], str]:
+    """根据角色卡生成检定用的骰子表达式，返回 (表达式, 属性名)"""
+    match = CHECK_PATTERN.match(text.strip())
+    if not match:
+        return None, text.strip()
+
+    name, extra, adv = match.groups()
+    modifier = sheet.get_modifier(name)
+    if modifier is None:
+        return None, name
+
+    modifier += int(extra) if extra else 0
+    expr = "d20"
+    if adv:
+        expr += f"{adv}2"
+    if modifier:
+        expr += f"{'+' if modifier > 0 else ''}{modifier}"
+    return expr, name
+
+def _send(wcf: Wcf, msg: WxMsg, content: str) -> None:
+    """发送回复消息"""
+    if msg.roomid:
+        wcf.send_text(content, msg.roomid)
+    else:
+        wcf.send_text(content, msg.sender)
+
+def handle_st_command(wcf: Wcf, msg: WxMsg, config: dict) -> None:
+    """处理.st命令"""
+    try:
+        args = msg.content.split('.st', 1)[1].strip()
+        store = get_character_store(config)
+        sheet = store.get(msg.roomid, msg.sender)
+        nickname = get_user_display_name(wcf, msg.sender, msg.roomid)
+
+        if not args or args == 'show':
+            reply = format_sheet(nickname, sheet)
+        elif args == 'clr':
+            store.clear(sheet)
+            reply = f"【{nickname}】的角色卡已清空"
+        else:
+            attrs = parse_attributes(args)
+            if not attrs:
+                reply = "无法解析属性，例如：.st 力量16 敏捷14 运动+5"
+            else:
+                store.update(sheet, attrs)
+                updated = " ".join(f"{name}{format_value(name, value)}" for name, value in attrs.items())
+                reply = f"【{nickname}】已录入 {len(attrs)} 项属性：{updated}"
+
+        _send(wcf, msg, reply)
+
+    except Exception as e:
+        logger.error(f"处理.st命令出错: {e}", exc_info=True)
+        _send(wcf, msg, "录入角色卡时出错")
+
+def handle_ra_command(wcf: Wcf, msg: WxMsg, config: dict) -> None:
+    """处理.ra命令"""
+    try:
+        args = msg.content.split('.ra', 1)[1].strip()
+        if not args:
+            _send(wcf, msg, "请指定要检定的属性，例如：.ra 敏捷")
+            return
+
+        sheet = get_character_store(config).get(msg.roomid, msg.sender)
+        expr, name = build_check_expression(sheet, args)
+        if expr is None:
+            _send(wcf, msg, f"角色卡中没有属性: {name}，请先使用 .st 录入")
+            return
+
+        roll_results, _ = process_roll_command(expr)
+        nickname = get_user_display_name(wcf, msg.sender, msg.roomid)
+        reply = f"【{nickname}】{name}检定\n{roll_results[0].format_detailed_result()}"
+        _send(wcf, msg, reply)
+
+    except Exception as e:
+        logger.error(f"处理.ra命令出错: {e}", exc_info=True)
+        _send(wcf, msg, "属性检定时出错")
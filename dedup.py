@@ -0,0 +1,58 @@
+import logging
+import threading
+from typing import Hashable, List, Optional, Set
+from wcferry import WxMsg
+
+logger = logging.getLogger(__name__)
+
+class MessageDeduplicator:
+    """基于定长环形缓冲区 + 集合的消息去重器，内存占用固定，判重为O(1)"""
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = max(1, capacity)
+        self._ring: List[Optional[Hashable]] = [None] * self.capacity
+        self._seen: Set[Hashable] = set()
+        self._pos = 0
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.dropped = 0
+
+    def configure(self, config: dict) -> None:
+        """从配置文件读取缓冲区大小（会清空已记录的消息）"""
+        capacity = config.get('dedup', {}).get('capacity', self.capacity)
+        with self._lock:
+            self.capacity = max(1, capacity)
+            self._ring = [None] * self.capacity
+            self._seen = set()
+            self._pos = 0
+
+    def accept(self, msg: WxMsg) -> bool:
+        """判断消息是否首次出现，重复消息返回False"""
+        msg_id = getattr(msg, 'id', None)
+        if not msg_id:
+            # 没有消息ID时无法判重，直接放行
+            self.accepted += 1
+            return True
+
+        with self._lock:
+            if msg_id in self._seen:
+                self.dropped += 1
+                logger.debug(f"丢弃重复消息: id={msg_id}")
+                return False
+
+            # 覆盖最旧的记录
+            oldest = self._ring[self._pos]
+            if oldest is not None:
+                self._seen.discard(oldest)
+            self._ring[self._pos] = msg_id
+            self._seen.add(msg_id)
+            self._pos = (self._pos + 1) % self.capacity
+            self.accepted += 1
+            return True
+
+    def status(self) -> str:
+        """返回去重统计信息"""
+        return f"消息去重: 已处理{self.accepted}条, 丢弃重复{self.dropped}条"
+
+deduplicator = MessageDeduplicator()
@@ -1,6 +1,8 @@
 import re
+import heapq
 import random
 import logging
+from collections import Counter
 from typing import Tuple, List, Union
 from dataclasses import dataclass
 
@@ -16,6 +18,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 单颗骰子最多连续爆骰的轮数，防止表达式无限展开
+EXPLODE_LIMIT = 100
+
 @dataclass
 class DiceRoll:
     """骰子投掷结果"""
@@ -26,26 +31,51 @@ class DiceRoll:
     adv_dice: int
     result: int
     detailed_rolls: List[List[int]]
+    keep: str = ''
+    keep_count: int = 0
+    explode: bool = False
+    reroll_below: int = 0
+    
+    def format_modifiers(self) -> str:
+        """格式化爆骰、重骰和取舍标记"""
+        expr = "!" if self.explode else ""
+        if self.reroll_below:
+            expr += f"r<{self.reroll_below}"
+        if self.keep:
+            expr += f"{self.keep}{self.keep_count}"
+        return expr
     
     def format_expression(self) -> str:
         """格式化骰子表达式"""
         expr = f"{self.num_dice}d{self.faces}" if self.num_dice > 1 else f"d{self.faces}"
+        expr += self.format_modifiers()
         if self.advantage:
             expr += f"{self.advantage}{self.adv_dice}"
         return expr  # 修正值将在详细结果中显示
     
     def format_detailed_result(self) -> str:
         """格式化详细投掷结果"""
+        if self.keep:
+            # 取舍投掷：detailed_rolls 为 [保留的点数, 舍弃的点数]
+            kept, dropped = self.detailed_rolls
+            result = f"{self.format_expression()}[ {' '.join(map(str, kept))}"
+            if dropped:
+                result += f" | 弃 {' '.join(map(str, dropped))}"
+            result += " ]"
+            if self.modifier != 0:
+                result += f" {'+' if self.modifier > 0 else ''}{self.modifier}"
+            return f"{result} = {self.result}"
+        
         # 检查是否为嵌套表达式或多次投掷
         if self.num_dice > 1:
             # ���套或多次投掷格式
-            base_expr = f"d{self.faces}"
+            base_expr = f"d{self.faces}{self.format_modifiers()}"
             if self.modifier != 0:
                 base_expr += f" {'+' if self.modifier > 0 else ''}{self.modifier}"
             expr = f"{self.num_dice}({base_expr})"
         else:
             # 单次投掷格式
-            expr = f"d{self.faces}"
+            expr = f"d{self.faces}{self.format_modifiers()}"
             if self.modifier != 0:
                 expr += f" {'+' if self.modifier > 0 else ''}{self.modifier}"
         
@@ -63,8 +93,8 @@ class DiceRoll:
             
             result = f"{expr}[ {' | '.join(roll_details)} ]"
         else:
-            # 普通或嵌套投掷的详细结果
-            roll_str = ' | '.join(str(rolls[0]) for rolls in self.detailed_rolls)
+            # 普通或嵌套投掷的详细结果，爆骰时显示每次追加的点数
+            roll_str = ' | '.join('+'.join(map(str, rolls)) for rolls in self.detailed_rolls)
             result = f"{expr}[ {roll_str} ]"
         
         # 添加调整值和最终结果
@@ -76,10 +106,38 @@ class DiceRoll:
         
         return result
 
-def parse_nested_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, int]], Union[None, str]]:
+# 骰子参数：(次数, 面数, 调整值, 优势类型, 优势骰子数, 取舍类型, 取舍数量, 是否爆骰, 重骰阈值)
+DiceParams = Tuple[int, int, int, str, int, str, int, bool, int]
+
+# 估算工作量用的宽松匹配：[重复次数(][骰子数]d面数[其余修饰][)]
+COST_PATTERN = re.compile(r'^(?:(\d+)\()?(\d*)d\d+([^()\s]*)\)?$')
+ADV_COUNT_PATTERN = re.compile(r'[ap](\d*)')
+# 估算时单个数字的上限，超长数字不做整数转换
+COST_LIMIT = 10 ** 9
+
+def _bounded_int(text: str, default: int = 1) -> int:
+    """将数字文本转换为整数，超过9位时按上限计"""
+    if not text:
+        return default
+    return COST_LIMIT if len(text) > 9 else int(text)
+
+def estimate_roll_cost(expr: str) -> int:
+    """不展开表达式，按 重复次数×骰子数×优势骰子数 估算投掷工作量"""
+    cost = 0
+    for token in expr.split():
+        match = COST_PATTERN.match(token)
+        if not match:
+            continue
+        repeat, dice, rest = match.groups()
+        adv = ADV_COUNT_PATTERN.search(rest)
+        adv_dice = _bounded_int(adv.group(1), 2) if adv else 1
+        cost += _bounded_int(repeat) * _bounded_int(dice) * adv_dice
+    return max(1, cost)
+
+def parse_nested_expression(expr: str) -> Tuple[List[DiceParams], Union[None, str]]:
     """解析嵌套的骰子表达式"""
-    # 处理嵌套格式：数字(表达式)
-    nested_pattern = r'^(\d+)\((\d*d\d+([ap]\d+)?([+-]\d+)?)\)$'
+    # 处理嵌套格式：数字(表达式)，内部表达式的合法性交由 parse_roll_expression 检查
+    nested_pattern = r'^(\d+)\((\d*d[^()\s]+)\)$'
     nested_match = re.match(nested_pattern, expr)
     
     if nested_match:
@@ -100,7 +158,7 @@ def parse_nested_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, i
         
     return [], expr
 
-def parse_roll_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, int]], Union[None, str]]:
+def parse_roll_expression(expr: str) -> Tuple[List[DiceParams], Union[None, str]]:
     """解析骰子表达式组合"""
     dice_params = []
     expressions = expr.strip().split()
@@ -124,16 +182,24 @@ def parse_roll_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, int
         modifier = 0     # 默认调整值
         advantage = ''  # 默认无优势/劣势
         adv_dice = 0    # 默认无优势/劣势骰子数
+        keep = ''       # 默认不取舍
+        keep_count = 0  # 默认取舍数量
+        reroll_below = 0  # 默认不重骰
         
         # 使用正则表达式解析
-        # 格式: [次数]d[面数][优势类型][优势骰子数][+-调整值]
-        pattern = r'^(\d+)?d(\d+)([ap])?(\d+)?([+-]\d+)?$'
+        # 格式: [次数]d[面数][!][r<重骰阈值][kh/kl/dh/dl取舍数量][优势类型][优势骰子数][+-调整值]
+        pattern = r'^(\d+)?d(\d+)(!)?(?:r<(\d+))?(?:(kh|kl|dh|dl)(\d+)?)?(?:([ap])(\d+)?)?([+-]\d+)?$'
         match = re.match(pattern, single_expr)
         
+        # 爆骰、重骰和取舍不能与优势/劣势组合使用
+        if match and match.group(7) and any(match.group(i) for i in (3, 4, 5)):
+            match = None
+        
         if match:
             # 解析各个部分
-            dice_num, faces, adv, adv_num, mod = match.groups()
-            logger.debug(f"匹配结果: dice_num={dice_num}, faces={faces}, adv={adv}, adv_num={adv_num}, mod={mod}")
+            dice_num, faces, bang, reroll, keep_type, keep_num, adv, adv_num, mod = match.groups()
+            logger.debug(f"匹配结果: dice_num={dice_num}, faces={faces}, explode={bang}, reroll={reroll}, "
+                         f"keep={keep_type}{keep_num or ''}, adv={adv}, adv_num={adv_num}, mod={mod}")
             
             if dice_num:
                 num_dice = int(dice_num)
@@ -147,8 +213,14 @@ def parse_roll_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, int
                     adv_dice = 2  # 默认2个优势/劣势
             if mod:
                 modifier = int(mod)
+            if keep_type:
+                keep = keep_type
+                keep_count = int(keep_num) if keep_num else 1
+            if reroll:
+                reroll_below = int(reroll)
                 
-            dice_params.append((num_dice, num_faces, modifier, advantage, adv_dice))
+            dice_params.append((num_dice, num_faces, modifier, advantage, adv_dice,
+                                keep, keep_count, bool(bang), reroll_below))
         else:
             # 收集无法解析的文本
             logger.debug(f"无法解析表达式: {single_expr}")
@@ -156,7 +228,48 @@ def parse_roll_expression(expr: str) -> Tuple[List[Tuple[int, int, int, str, int
             
     return dice_params, " ".join(invalid_text) if invalid_text else None
 
-def roll_single_dice(num_rolls: int, faces: int, modifier: int, advantage: str, adv_dice: int) -> DiceRoll:
+def roll_dice_batch(faces: int, count: int, explode: bool = False, reroll_below: int = 0) -> List[List[int]]:
+    """批量投掷骰子，返回每颗骰子的点数链（爆骰时包含追加的点数）"""
+    values = random.choices(range(1, faces + 1), k=count)
+    
+    if reroll_below:
+        # 点数不高于阈值的骰子重骰一次
+        low = [i for i, value in enumerate(values) if value <= reroll_below]
+        for i, value in zip(low, random.choices(range(1, faces + 1), k=len(low))):
+            values[i] = value
+    
+    chains = [[value] for value in values]
+    
+    if explode and faces > 1:
+        # 每轮只为掷出最大值的骰子批量追加一次投掷
+        active = [chain for chain in chains if chain[0] == faces]
+        rounds = 0
+        while active and rounds < EXPLODE_LIMIT:
+            extra = random.choices(range(1, faces + 1), k=len(active))
+            for chain, value in zip(active, extra):
+                chain.append(value)
+            active = [chain for chain, value in zip(active, extra) if value == faces]
+            rounds += 1
+    
+    return chains
+
+def select_kept(totals: List[int], keep: str, keep_count: int) -> Tuple[List[int], List[int]]:
+    """按取舍规则划分保留与舍弃的点数，使用堆做部分选择而非完整排序"""
+    if keep in ('kh', 'kl'):
+        count = keep_count
+        highest = keep == 'kh'
+    else:
+        # 舍弃最高/最低n个，等价于保留相反方向的其余骰子
+        count = len(totals) - keep_count
+        highest = keep == 'dl'
+    count = max(0, min(len(totals), count))
+    
+    kept = heapq.nlargest(count, totals) if highest else heapq.nsmallest(count, totals)
+    dropped = list((Counter(totals) - Counter(kept)).elements())
+    return kept, dropped
+
+def roll_single_dice(num_rolls: int, faces: int, modifier: int, advantage: str, adv_dice: int,
+                     keep: str = '', keep_count: int = 0, explode: bool = False, reroll_below: int = 0) -> DiceRoll:
     """投掷骰子并计算结果
     
     Args:
@@ -165,7 +278,35 @@ def roll_single_dice(num_rolls: int, faces: int, modifier: int, advantage: str,
         modifier: 调整值
         advantage: 优势类型 ('a'/'p')
         adv_dice: 优势/劣势骰子数
+        keep: 取舍类型 ('kh'/'kl'/'dh'/'dl')，此时所有骰子作为一组计算
+        keep_count: 取舍数量
+        explode: 是否爆骰（掷出最大值时追加投掷）
+        reroll_below: 点数不高于该值时重骰一次
     """
+    if keep or explode or reroll_below:
+        chains = roll_dice_batch(faces, num_rolls, explode, reroll_below)
+        if keep:
+            kept, dropped = select_kept([sum(chain) for chain in chains], keep, keep_count)
+            all_results = [kept, dropped]
+            final_result = sum(kept) + modifier
+        else:
+            all_results = chains
+            final_result = sum(sum(chain) for chain in chains) + modifier
+        
+        return DiceRoll(
+            num_dice=num_rolls,
+            faces=faces,
+            modifier=modifier,
+            advantage=advantage,
+            adv_dice=adv_dice,
+            result=final_result,
+            detailed_rolls=all_results,
+            keep=keep,
+            keep_count=keep_count,
+            explode=explode,
+            reroll_below=reroll_below
+        )
+    
     all_results = []
     
     for _ in range(num_rolls):
@@ -208,6 +349,7 @@ def dicehelp() -> str:
     """返回帮助信息"""
     help_text = """骰子指令说明:
 格式: .r [投掷次数]d[面数][优势类型][优势骰子数][+-调整值]
+      .r [骰子数]d[面数][!][r<阈值][kh/kl/dh/dl数量][+-调整值]
       .r 重复次数(表达式)
 
 基础示例:
@@ -219,6 +361,14 @@ def dicehelp() -> str:
 .r d20a3      - 投掷1次d20(同时投3个骰子取最大值)
 .r d20p3      - 投掷1次d20(同时投3个骰子取最小值)
 
+取舍/爆骰/重骰:
+.r 4d6kh3     - 投掷4个d6取最高的3个
+.r 2d20kl1    - 投掷2个d20取最低的1个
+.r 4d6dl1     - 投掷4个d6去掉最低的1个
+.r 3d6!       - 投掷3个d6，掷出6时追加投掷
+.r 2d6r<2     - 投掷2个d6，点数不高于2的骰子重骰一次
+.r 6(4d6kh3)  - 生成6项属性值
+
 嵌套表达式:
 .r 3(d4+2)    - 投掷3次(1d4+2)
 .r 2(d20a2)   - 投掷2次(1d20优势2)
@@ -238,12 +388,24 @@ def dicehelp() -> str:
 4. 可以组合多个骰子表达式，用空格分隔
 5. 可以使用数字(表达式)的形式重复相同的表达式
 6. 每个表达式都可以包含投掷次数、面数、优势/劣势和调整值
-7. 默认使用1d100"""
+7. 默认使用1d100
+8. kh/kl为保留最高/最低，dh/dl为去掉最高/最低，省略数量时为1
+9. 爆骰每颗骰子最多追加100次；取舍、爆骰和重骰不能与a/p同时使用"""
     return help_text
 
-def process_roll_command(command: str) -> Tuple[List[DiceRoll], Union[int, str]]:
-    """处理骰子命令并返回结果"""
-    dice_params, invalid_expr = parse_roll_expression(command)
+def process_roll_command(command: str, parse_cache: dict = None) -> Tuple[List[DiceRoll], Union[int, str]]:
+    """处理骰子命令并返回结果
+
+    Args:
+        command: 骰子表达式
+        parse_cache: 可选的解析结果缓存，批量执行时由调用方提供，相同表达式只解析一次
+    """
+    if parse_cache is None:
+        dice_params, invalid_expr = parse_roll_expression(command)
+    else:
+        if command not in parse_cache:
+            parse_cache[command] = parse_roll_expression(command)
+        dice_params, invalid_expr = parse_cache[command]
     
     # 如果没有有效的骰子表达式
     if not dice_params:
@@ -260,13 +422,21 @@ def process_roll_command(command: str) -> Tuple[List[DiceRoll], Union[int, str]]
     
     return roll_results, total_result
 
-def format_reply_message(nickname: str, roll_results: List[DiceRoll], result: Union[int, Tuple[int, str]]) -> str:
-    """格式化回复消息"""
+def format_reply_message(nickname: str, roll_results: List[DiceRoll], result: Union[int, Tuple[int, str]],
+                         summary: bool = False) -> str:
+    """格式化回复消息，summary为True时只回复总结果"""
     reply = f"【{nickname}】\n"
     
     if isinstance(result, str):
         # 处理无效的骰子表达式
         reply += result
+    elif summary:
+        # 精简结果：不展开每颗骰子
+        total = result[0] if isinstance(result, tuple) else result
+        if len(roll_results) > 1:
+            reply += f"{len(roll_results)}组投掷 = {total}"
+        else:
+            reply += f"{roll_results[0].format_expression()} = {total}"
     elif isinstance(result, tuple):
         # 骰子结果 + 额外文本
         total, text = result
@@ -4,6 +4,9 @@ from datetime import datetime
 from typing import Tuple
 from wcferry import Wcf, WxMsg
 from dice_roller import dicehelp, format_reply_message
+from dedup import deduplicator
+from load_control import load_controller
+from worker_pool import worker_pool
 import json
 import os
 
@@ -15,26 +18,42 @@ jrrp_queried = {}
 
 # 存储用户查询记录的字典
 deck_cache = {}  # 用于缓存已加载的牌堆
+name_cache = {}  # 用于缓存已查询到的用户昵称，高负载时代替昵称查询
+NAME_CACHE_SIZE = 5000  # 昵称缓存最多保留的条目数
+
+def cache_display_name(cache_key: tuple, name: str) -> None:
+    """缓存昵称，超出上限时淘汰最早写入的条目"""
+    name_cache.pop(cache_key, None)
+    name_cache[cache_key] = name
+    while len(name_cache) > NAME_CACHE_SIZE:
+        name_cache.pop(next(iter(name_cache)))
 
 def get_user_display_name(wcf: Wcf, wxid: str, room_id: str = None) -> str:
     """获取用户显示名称"""
+    cache_key = (wxid, room_id)
+    if load_controller.skip_nickname_rpc():
+        return name_cache.get(cache_key, wxid)
+    
     logger.debug(f"开始获取用户信息: wxid={wxid}, room_id={room_id}")
     
     try:
         if room_id:
             group_nickname = wcf.get_alias_in_chatroom(wxid, room_id)
             if group_nickname:
+                cache_display_name(cache_key, group_nickname)
                 return group_nickname
         
         friends = wcf.get_contacts()
         for friend in friends:
             if wxid == friend.get("wxid"):
                 logger.debug(f"使用微信昵称: {friend['name']}")
+                cache_display_name(cache_key, friend['name'])
                 return friend['name']
         
         for groupid, group_users in wcf.group_users.items():
             if group_users.get(wxid) is not None:
                 logger.debug(f"使用群成员昵称: {group_users[wxid]}")
+                cache_display_name(cache_key, group_users[wxid])
                 return group_users[wxid]
         
         logger.debug("无法获取用户名称，使用默认")
@@ -153,6 +172,8 @@ def handle_dnd_command(wcf: Wcf, msg: WxMsg, dnd_data: dict) -> None:
             reply = "请输入要查询的关键词，例如：.dnd 武器"
         else:
             reply = search_dnd_term(dnd_data, keyword)
+            if load_controller.summary_only() and len(reply) > load_controller.dnd_max_chars:
+                reply = reply[:load_controller.dnd_max_chars] + "...(繁忙中，内容已截断)"
         
         if msg.roomid:
             wcf.send_text(reply, msg.roomid)
@@ -295,6 +316,9 @@ def handle_sys_command(wcf: Wcf, msg: WxMsg) -> None:
     """处理.sys命令"""
     try:
         status_info = "机器人状态: 正常运行\n"
+        status_info += f"{load_controller.status()}\n"
+        status_info += f"{deduplicator.status()}\n"
+        status_info += f"{worker_pool.status()}\n"
         
         if msg.roomid:
             wcf.send_text(status_info, msg.roomid)
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 降级等级，等级越高处理越精简；每一级都包含前面各级的降级措施
+LEVEL_NORMAL = 0
+LEVEL_QUIET = 1         # 不再记录普通聊天消息日志
+LEVEL_NO_RPC = 2        # 不再查询昵称，使用缓存的昵称或wxid
+LEVEL_SUMMARY = 3       # 骰子只回复总结果，.dnd 回复截断
+LEVEL_REJECT = 4        # 拒绝高开销命令
+
+LEVEL_NAMES = {
+    LEVEL_NORMAL: "正常",
+    LEVEL_QUIET: "精简日志",
+    LEVEL_NO_RPC: "跳过昵称查询",
+    LEVEL_SUMMARY: "精简回复",
+    LEVEL_REJECT: "拒绝高开销命令",
+}
+
+class LoadController:
+    """根据消息排队时间和处理耗时的延迟目标(SLO)自动调整降级等级
+
+    排队时间按 待处理消息数 × 每条消息的处理周期 估算：消息积压在wcferry的内部队列中，
+    单条消息在本地被取出后才开始计时，无法反映积压。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.enabled = True
+        self.slo = 2.0               # 延迟目标（秒）
+        self.alpha = 0.2             # 指数滑动平均系数
+        self.recover_ratio = 0.5     # 平均延迟低于 SLO*该比例 时逐级恢复
+        self.min_dwell = 10.0        # 两次等级调整之间的最短间隔（秒）
+        self.dnd_max_chars = 300
+        self.expensive_commands = ['.dnd', '.drawhelp']
+
+        self.level = LEVEL_NORMAL
+        self.ewma: Optional[float] = None
+        self.service_time: Optional[float] = None   # 每条消息占用的处理周期（秒）
+        self.queue_depth = 0
+        self.shed_count = 0
+        self._changed_at = 0.0
+        self._last_observed = 0.0
+        self._last_handled = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict) -> None:
+        """从配置文件读取参数"""
+        lc_config = config.get('load_control', {})
+        self.enabled = lc_config.get('enabled', self.enabled)
+        self.slo = lc_config.get('slo_ms', self.slo * 1000) / 1000
+        self.alpha = lc_config.get('ewma_alpha', self.alpha)
+        self.recover_ratio = lc_config.get('recover_ratio', self.recover_ratio)
+        self.min_dwell = lc_config.get('min_dwell', self.min_dwell)
+        self.dnd_max_chars = lc_config.get('dnd_max_chars', self.dnd_max_chars)
+        self.expensive_commands = lc_config.get('expensive_commands', self.expensive_commands)
+
+    def observe(self, queue_wait: float, handle_time: float, queue_depth: int = 0) -> None:
+        """记录一条消息的排队时间、处理耗时（秒）以及处理完成时仍在排队的消息数"""
+        if not self.enabled:
+            return
+
+        now = self.clock()
+        with self._lock:
+            # 上一条消息处理完时仍有积压，则两次处理的间隔就是每条消息实际占用的周期（含主循环的等待）
+            cycle = now - self._last_handled if self.queue_depth > 0 else handle_time
+            self.service_time = cycle if self.service_time is None else \
+                self.alpha * cycle + (1 - self.alpha) * self.service_time
+            self.queue_depth = queue_depth
+            self._last_handled = now
+
+            latency = max(0.0, queue_wait) + queue_depth * self.service_time + handle_time
+            self._last_observed = now
+            self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+            self._adjust(now)
+
+    def tick(self) -> None:
+        """空闲时调用，长时间没有新消息时逐步衰减平均延迟以便恢复"""
+        if not self.enabled or self.level == LEVEL_NORMAL:
+            return
+
+        now = self.clock()
+        with self._lock:
+            if self.ewma is not None and now - self._last_observed >= self.min_dwell:
+                self._last_observed = now
+                self.ewma *= 1 - self.alpha
+                self._adjust(now)
+
+    def _adjust(self, now: float) -> None:
+        """根据平均延迟升降一级（调用方需持有锁）"""
+        if now - self._changed_at < self.min_dwell:
+            return
+
+        if self.ewma > self.slo and self.level < LEVEL_REJECT:
+            self._set_level(self.level + 1, now)
+        elif self.ewma < self.slo * self.recover_ratio and self.level > LEVEL_NORMAL:
+            self._set_level(self.level - 1, now)
+
+    def _set_level(self, level: int, now: float) -> None:
+        old_level = self.level
+        self.level = level
+        self._changed_at = now
+        logger.warning(f"降级等级变更: {LEVEL_NAMES[old_level]} -> {LEVEL_NAMES[level]} "
+                       f"(平均延迟 {self.ewma * 1000:.0f}ms, 目标 {self.slo * 1000:.0f}ms)")
+
+    def log_chatter(self) -> bool:
+        """是否记录普通聊天消息"""
+        return self.level < LEVEL_QUIET
+
+    def skip_nickname_rpc(self) -> bool:
+        """是否跳过昵称查询"""
+        return self.level >= LEVEL_NO_RPC
+
+    def summary_only(self) -> bool:
+        """是否只回复精简结果"""
+        return self.level >= LEVEL_SUMMARY
+
+    def should_reject(self, command: str) -> bool:
+        """是否拒绝执行该命令"""
+        if self.level >= LEVEL_REJECT and command in self.expensive_commands:
+            self.shed_count += 1
+            return True
+        return False
+
+    def status(self) -> str:
+        """返回当前降级状态描述"""
+        if not self.enabled:
+            return "负载控制: 未启用"
+        ewma = f"{self.ewma * 1000:.0f}ms" if self.ewma is not None else "无数据"
+        return (f"负载模式: {LEVEL_NAMES[self.level]} (平均延迟 {ewma}, 目标 {self.slo * 1000:.0f}ms, "
+                f"排队{self.queue_depth}条, 已拒绝{self.shed_count}条命令)")
+
+load_controller = LoadController()
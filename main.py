@@ -4,8 +4,15 @@ from queue import Empty
 import yaml
 import os
 import json
-from wcferry import Wcf
-from robot import handle_message
+from robot import handle_message, CommandHandler
+from character import close_character_store
+from profiler import profiler
+from dedup import deduplicator
+from traffic import create_recorder
+from load_control import load_controller
+from supervisor import WcfSupervisor
+from scheduler import get_scheduler, close_scheduler, deliver_fired_timers
+from worker_pool import worker_pool
 
 logger = logging.getLogger(__name__)
 
@@ -54,8 +61,13 @@ def main():
     # 加载配置
     config = load_config()
     setup_logging(config)
+    profiler.configure(config)
+    deduplicator.configure(config)
+    load_controller.configure(config)
+    CommandHandler().configure(config)
     
-    wcf = Wcf()
+    supervisor = WcfSupervisor(config)
+    recorder = create_recorder(config)
     logger.info("正在启动骰子机器人...")
     
     try:
@@ -66,17 +78,14 @@ def main():
         if not dnd_data:
             logger.error(f"D&D数据加载失败或为空")
         
-        # 启用消息接收
-        wcf.enable_receiving_msg()
+        # 恢复持久化的定时任务
+        get_scheduler(config)
         
-        retry_count = 0
-        max_retries = 5
-        while not wcf.is_receiving_msg() and retry_count < max_retries:
-            retry_count += 1
-            logger.info(f"等待消息接收功能启动... ({retry_count}/{max_retries})")
-            time.sleep(1)
+        # 启动高开销命令的进程池
+        worker_pool.start(config)
         
-        if not wcf.is_receiving_msg():
+        # 启用消息接收
+        if not supervisor.connect():
             logger.error("消息接收功能启动失败")
             return
             
@@ -85,17 +94,32 @@ def main():
         # 主循环
         while True:
             try:
-                msg = wcf.get_msg()
-                if msg:
-                    handle_message(wcf, msg, config, dnd_data)
+                load_controller.tick()
+                deliver_fired_timers(supervisor.wcf)
+                worker_pool.poll(supervisor.wcf)
+                msg, arrived_at = supervisor.next_message()
+                if msg and recorder:
+                    recorder.record(msg)
+                # 重连后可能收到重复投递的消息，只处理首次出现的
+                if msg and deduplicator.accept(msg):
+                    # 排队时间以本地收到消息的时刻为准，不使用微信侧的秒级时间戳；
+                    # 积压在wcferry队列中的时间由负载控制按排队消息数估算
+                    started = time.monotonic()
+                    handle_message(supervisor.wcf, msg, config, dnd_data)
+                    load_controller.observe(started - arrived_at, time.monotonic() - started,
+                                            supervisor.queue_depth())
             except Empty:
-                continue
+                # 空闲时也需要检查连接状态
+                pass
             except Exception as e:
                 logger.error(f"获取消息时发生错误: {e}", exc_info=True)
                 
-            if not wcf.is_receiving_msg():
-                logger.error("消息接收功能已断开")
-                break
+            if not supervisor.is_healthy():
+                # 断线后原地重连，已加载的数据和各类缓存保留在进程内
+                logger.error("消息接收功能已断开，正在重新连接")
+                if not supervisor.recover():
+                    logger.error("重新连接失败")
+                    break
             
             time.sleep(0.1)
             
@@ -104,7 +128,12 @@ def main():
     except Exception as e:
         logger.error(f"运行时发生错误: {e}", exc_info=True)
     finally:
-        wcf.cleanup()
+        close_character_store()
+        close_scheduler()
+        worker_pool.shutdown()
+        if recorder:
+            recorder.close()
+        supervisor.close()
         logger.info("骰子机器人已停止")
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from wcferry import Wcf, WxMsg
+
+logger = logging.getLogger(__name__)
+
+class StackRecorder:
+    """基于 sys.setprofile 的调用栈记录器，按自身耗时（微秒）汇总折叠栈"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.samples: Dict[str, int] = defaultdict(int)
+        # 栈中每一项为 [折叠栈路径, 开始时间, 子调用耗时]
+        self._stack: List[list] = []
+
+    def _push(self, label: str) -> None:
+        parent = self._stack[-1][0] if self._stack else self.root
+        self._stack.append([f"{parent};{label}", time.perf_counter(), 0.0])
+
+    def _pop(self) -> None:
+        if not self._stack:
+            return
+        path, start, child_time = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.samples[path] += int((elapsed - child_time) * 1_000_000)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def _callback(self, frame, event: str, arg: Any) -> None:
+        if event == 'call':
+            code = frame.f_code
+            self._push(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        elif event == 'c_call':
+            self._push(f"{getattr(arg, '__qualname__', arg)} (builtin)")
+        elif event in ('return', 'c_return', 'c_exception'):
+            self._pop()
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在记录状态下执行函数"""
+        start = time.perf_counter()
+        sys.setprofile(self._callback)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+            # 丢弃 setprofile 自身造成的未闭合栈帧
+            self._stack.clear()
+            total = int((time.perf_counter() - start) * 1_000_000)
+            self.samples[self.root] += max(0, total - sum(self.samples.values()))
+
+class CommandProfiler:
+    """按命令采样的性能分析器，输出可直接用于火焰图工具的折叠栈文件"""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.command_filter: Optional[str] = None
+        self.output_dir = "profiles"
+        self.sampled_count: Dict[str, int] = defaultdict(int)
+        self._stacks: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def configure(self, config: dict) -> None:
+        """从配置文件读取默认参数"""
+        prof_config = config.get('profiling', {})
+        self.sample_rate = prof_config.get('sample_rate', self.sample_rate)
+        self.command_filter = prof_config.get('command_filter', self.command_filter)
+        self.output_dir = prof_config.get('output_dir', self.output_dir)
+        self.enabled = prof_config.get('enabled', self.enabled)
+
+    def should_sample(self, command: str) -> bool:
+        """判断本次命令是否需要采样"""
+        if self.command_filter:
+            return command == self.command_filter
+        return random.random() < self.sample_rate
+
+    def run(self, command: str, func: Callable, *args, **kwargs) -> Any:
+        """执行命令，按采样规则记录调用栈"""
+        if not self.should_sample(command):
+            return func(*args, **kwargs)
+
+        recorder = StackRecorder(command)
+        try:
+            return recorder.run(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.sampled_count[command] += 1
+                stacks = self._stacks[command]
+                for path, weight in recorder.samples.items():
+                    if weight > 0:
+                        stacks[path] += weight
+
+    def dump(self) -> List[str]:
+        """将已汇总的调用栈写入折叠栈文件，返回生成的文件列表"""
+        with self._lock:
+            snapshot = {cmd: dict(stacks) for cmd, stacks in self._stacks.items()}
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        output_dir = os.path.join(current_dir, self.output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        files = []
+        for command, stacks in snapshot.items():
+            file_path = os.path.join(output_dir, f"{command.lstrip('.')}.folded")
+            with open(file_path, 'w', encoding='utf-8') as f:
+                for path, weight in sorted(stacks.items()):
+                    f.write(f"{path} {weight}\n")
+            files.append(file_path)
+        return files
+
+    def reset(self) -> None:
+        """清空已采集的数据"""
+        with self._lock:
+            self._stacks.clear()
+            self.sampled_count.clear()
+
+    def status(self) -> str:
+        """返回当前分析器状态描述"""
+        state = "开启" if self.enabled else "关闭"
+        target = f"仅命令 {self.command_filter}" if self.command_filter else f"采样率 {self.sample_rate:.0%}"
+        with self._lock:
+            counts = ", ".join(f"{cmd}×{n}" for cmd, n in self.sampled_count.items()) or "无"
+        return f"性能分析: {state}\n采样规则: {target}\n已采样: {counts}"
+
+profiler = CommandProfiler()
+
+def is_admin(config: dict, wxid: str) -> bool:
+    """判断用户是否为管理员"""
+    return wxid in (config.get('admin', {}).get('wxids') or [])
+
+def handle_prof_command(wcf: Wcf, msg: WxMsg, config: dict) -> None:
+    """处理.prof命令（仅管理员可用）"""
+    try:
+        if not is_admin(config, msg.sender):
+            return
+
+        parts = msg.content.split('.prof', 1)[1].strip().split()
+        action = parts[0] if parts else 'status'
+
+        if action == 'on':
+            # .prof on [采样率或命令名]
+            profiler.command_filter = None
+            if len(parts) > 1:
+                if parts[1].startswith('.'):
+                    profiler.command_filter = parts[1]
+                else:
+                    profiler.sample_rate = min(1.0, max(0.0, float(parts[1])))
+            profiler.enabled = True
+            reply = profiler.status()
+        elif action == 'off':
+            profiler.enabled = False
+            reply = profiler.status()
+        elif action == 'dump':
+            files = profiler.dump()
+            reply = "已写入折叠栈文件:\n" + "\n".join(files) if files else "暂无采样数据"
+        elif action == 'reset':
+            profiler.reset()
+            reply = "已清空采样数据"
+        else:
+            reply = profiler.status()
+
+        if msg.roomid:
+            wcf.send_text(reply, msg.roomid)
+        else:
+            wcf.send_text(reply, msg.sender)
+
+    except Exception as e:
+        logger.error(f"处理.prof命令出错: {e}", exc_info=True)
+        error_msg = "性能分析命令出错，用法：.prof on [采样率|命令] / off / dump / reset"
+        if msg.roomid:
+            wcf.send_text(error_msg, msg.roomid)
+        else:
+            wcf.send_text(error_msg, msg.sender)
@@ -1,5 +1,7 @@
+import copy
 import logging
-from typing import Callable, Dict, Optional
+import re
+from typing import Callable, Dict, List, Optional, Tuple
 from wcferry import Wcf, WxMsg
 from functions import (
     handle_dicehelp_command,
@@ -10,10 +12,18 @@ from functions import (
     handle_sys_command,
     get_user_display_name
 )
-from dice_roller import process_roll_command, format_reply_message
+from dice_roller import process_roll_command, format_reply_message, estimate_roll_cost, COST_LIMIT
+from character import handle_st_command, handle_ra_command
+from profiler import profiler, handle_prof_command
+from load_control import load_controller
+from scheduler import handle_timer_command, handle_remind_command
+from worker_pool import worker_pool
 
 logger = logging.getLogger(__name__)
 
+# 一条消息中的多个命令以换行或分号分隔，仅在分隔符后紧跟命令时拆分
+BATCH_SEPARATOR = re.compile(r'[\n;；]\s*(?=\.)')
+
 # 消息类型映射
 MSG_TYPES = {
     1: "文本消息",
@@ -34,6 +44,34 @@ MSG_TYPES = {
     62: "小视频消息",
 }
 
+class BatchWcf:
+    """批量执行命令时使用的Wcf代理：同一批次内共享昵称查询结果，回复收集后统一发送"""
+    
+    def __init__(self, wcf: Wcf):
+        self._wcf = wcf
+        self.replies: List[str] = []
+        self.parse_cache: Dict[str, tuple] = {}  # 本批次内的骰子表达式解析结果，随批次结束释放
+        self._aliases: Dict[Tuple[str, str], str] = {}
+        self._contacts: Optional[List[dict]] = None
+    
+    def send_text(self, msg: str, receiver: str, aters: str = "") -> int:
+        self.replies.append(msg)
+        return 0
+    
+    def get_alias_in_chatroom(self, wxid: str, roomid: str) -> str:
+        key = (wxid, roomid)
+        if key not in self._aliases:
+            self._aliases[key] = self._wcf.get_alias_in_chatroom(wxid, roomid)
+        return self._aliases[key]
+    
+    def get_contacts(self) -> List[dict]:
+        if self._contacts is None:
+            self._contacts = self._wcf.get_contacts()
+        return self._contacts
+    
+    def __getattr__(self, name: str):
+        return getattr(self._wcf, name)
+
 class CommandHandler:
     """命令处理器类"""
     
@@ -49,9 +87,17 @@ class CommandHandler:
         """只在第一次创建实例时初始化"""
         if not hasattr(self, 'initialized'):
             self.commands: Dict[str, Dict[str, any]] = {}
+            self.max_batch_commands = 10
+            self.max_batch_cost = 5000
             self._register_commands()
             self.initialized = True
     
+    def configure(self, config: dict) -> None:
+        """从配置文件读取批量执行限制"""
+        batch_config = config.get('batch', {})
+        self.max_batch_commands = batch_config.get('max_commands', self.max_batch_commands)
+        self.max_batch_cost = batch_config.get('max_cost', self.max_batch_cost)
+    
     def _register_commands(self):
         """注册所有命令处理函数及其所需参数"""
         self.commands = {
@@ -60,6 +106,21 @@ class CommandHandler:
                 'needs_config': True,
                 'needs_dnd_data': False
             },
+            '.ra': {
+                'handler': handle_ra_command,
+                'needs_config': True,
+                'needs_dnd_data': False
+            },
+            '.remind': {
+                'handler': handle_remind_command,
+                'needs_config': True,
+                'needs_dnd_data': False
+            },
+            '.st': {
+                'handler': handle_st_command,
+                'needs_config': True,
+                'needs_dnd_data': False
+            },
             '.r': {
                 'handler': self.handle_roll_command,
                 'needs_config': False,
@@ -94,23 +155,47 @@ class CommandHandler:
                 'handler': handle_draw_command,
                 'needs_config': True,
                 'needs_dnd_data': False
+            },
+            '.timer': {
+                'handler': handle_timer_command,
+                'needs_config': True,
+                'needs_dnd_data': False
+            },
+            '.prof': {
+                'handler': handle_prof_command,
+                'needs_config': True,
+                'needs_dnd_data': False
             }
         }
     
-    def get_command_info(self, command: str) -> Optional[Dict[str, any]]:
-        """获取命令对应的处理函数和参数需求"""
+    def match_command(self, command: str) -> Tuple[Optional[str], Optional[Dict[str, any]]]:
+        """获取命令前缀及其对应的处理函数和参数需求"""
         for cmd_prefix, info in self.commands.items():
             if command.startswith(cmd_prefix):
-                return info
-        return None
+                return cmd_prefix, info
+        return None, None
+    
+    def get_command_info(self, command: str) -> Optional[Dict[str, any]]:
+        """获取命令对应的处理函数和参数需求"""
+        return self.match_command(command)[1]
+    
+    def estimate_cost(self, command_name: str, content: str) -> int:
+        """估算命令的工作量：掷骰按骰子数计，抽卡按张数计，其余命令计1；只做文本匹配，不展开表达式"""
+        if command_name == '.r':
+            return estimate_roll_cost(content.split('.r', 1)[1])
+        if command_name == '.draw':
+            parts = content.split('.draw', 1)[1].split()
+            if len(parts) > 1 and parts[1].isdecimal():
+                return COST_LIMIT if len(parts[1]) > 9 else int(parts[1])
+        return 1
     
     def handle_roll_command(self, wcf: Wcf, msg: WxMsg, **kwargs) -> None:
         """处理骰子命令"""
         try:
             command = msg.content.split('.r', 1)[1].strip()
-            roll_results, result = process_roll_command(command)
+            roll_results, result = process_roll_command(command, getattr(wcf, 'parse_cache', None))
             nickname = get_user_display_name(wcf, msg.sender, msg.roomid)
-            reply = format_reply_message(nickname, roll_results, result)
+            reply = format_reply_message(nickname, roll_results, result, summary=load_controller.summary_only())
             self._send_message(wcf, msg, reply)
             
         except Exception as e:
@@ -122,35 +207,101 @@ class CommandHandler:
         help_text = """可用指令说明：
 .r [骰子表达式] - 投掷骰子（使用 .dicehelp 查看详细用法）
 .dicehelp - 显示详细的骰子指令说明
+.st [属性名数值] - 录入角色卡属性（.st 查看，.st clr 清空）
+.ra [属性名] - 使用角色卡属性进行检定（可追加 a/p 表示优势/劣势）
 .jrrp - 查看今日人品值（每人每天仅能查询一次）
 .dnd [关键词] - 查询D&D规则内容
 .draw [牌堆名] [数量] - 从指定牌堆抽取卡牌
 .drawhelp - 显示所有牌堆信息和使用示例
+.timer [时长] [内容] - 设置计时器（.timer list 查看，.timer del 编号 取消）
+.remind [时刻或时长] [内容] - 设置提醒
 .sys - 查看机器人运行状态
+多个命令可以用换行或分号分隔，在一条消息中发送
 
 示例：
 .r d20 - 投掷一个20面骰
+.st 力量16 敏捷14 - 录入力量和敏捷
+.ra 敏捷 - 进行敏捷检定
 .dnd 武器 - 查询与武器相关的规则
 .jrrp - 查看今天的人品值
+.timer 5m 下一轮 - 5分钟后提醒下一轮
+.remind 20:00 开团 - 20点提醒开团
 .draw dmt 1 - 从万象无常牌堆抽1张卡
-.drawhelp - 查看所有牌堆信息"""
+.drawhelp - 查看所有牌堆信息
+.r d20+5; .r 2d6+3 - 一次发送两个命令"""
         
         self._send_message(wcf, msg, help_text)
     
     def execute_command(self, wcf: Wcf, msg: WxMsg, config: dict = None, dnd_data: dict = None) -> None:
-        """执行命令"""
+        """执行命令，一条消息包含多个命令时按批次执行"""
+        segments = [segment.strip() for segment in BATCH_SEPARATOR.split(msg.content)]
+        if len(segments) > 1:
+            self.execute_batch(wcf, msg, segments, config, dnd_data)
+        else:
+            self._dispatch(wcf, msg, config, dnd_data)
+    
+    def execute_batch(self, wcf: Wcf, msg: WxMsg, segments: List[str],
+                      config: dict = None, dnd_data: dict = None) -> None:
+        """批量执行命令：共享昵称查询，按总工作量限制执行数量，合并为一条回复"""
+        batch_wcf = BatchWcf(wcf)
+        total_cost = 0
+        skipped = 0
+        
+        for index, segment in enumerate(segments):
+            command_name, command_info = self.match_command(segment)
+            if not command_info:
+                continue
+            
+            try:
+                total_cost += self.estimate_cost(command_name, segment)
+            except Exception as e:
+                logger.error(f"估算命令工作量出错: {e}", exc_info=True)
+                batch_wcf.replies.append(f"命令执行出错: {segment[:50]}")
+                continue
+            if index >= self.max_batch_commands or total_cost > self.max_batch_cost:
+                skipped = len(segments) - index
+                break
+            
+            segment_msg = copy.copy(msg)
+            segment_msg.content = segment
+            # 批次总工作量已受限制，各命令在本进程内执行，保证回复合并且顺序不变
+            self._dispatch(batch_wcf, segment_msg, config, dnd_data, offload=False)
+        
+        replies = batch_wcf.replies
+        if skipped:
+            replies.append(f"本条消息命令过多或工作量过大，其余 {skipped} 条命令未执行")
+        if replies:
+            self._send_message(wcf, msg, "\n\n".join(replies))
+    
+    def _dispatch(self, wcf: Wcf, msg: WxMsg, config: dict = None, dnd_data: dict = None,
+                  offload: bool = True) -> None:
+        """执行单个命令，offload为False时不交给进程池"""
         try:
-            command_info = self.get_command_info(msg.content)
+            command_name, command_info = self.match_command(msg.content)
             if not command_info:
                 return
             
+            if load_controller.should_reject(command_name):
+                self._send_message(wcf, msg, "机器人当前繁忙，请稍后再试")
+                return
+            
+            # 高开销命令交给进程池执行，避免阻塞消息接收
+            if offload and worker_pool.enabled and worker_pool.is_heavy(command_name, self.estimate_cost(command_name, msg.content)):
+                nickname = get_user_display_name(wcf, msg.sender, msg.roomid)
+                if not worker_pool.submit(command_name, msg.content, msg.sender, msg.roomid, nickname):
+                    self._send_message(wcf, msg, "机器人当前繁忙，请稍后再试")
+                return
+            
             kwargs = {}
             if command_info['needs_config']:
                 kwargs['config'] = config
             if command_info['needs_dnd_data']:
                 kwargs['dnd_data'] = dnd_data
             
-            command_info['handler'](wcf, msg, **kwargs)
+            if profiler.enabled:
+                profiler.run(command_name, command_info['handler'], wcf, msg, **kwargs)
+            else:
+                command_info['handler'](wcf, msg, **kwargs)
             
         except Exception as e:
             logger.error(f"执行命令出错: {e}", exc_info=True)
@@ -171,6 +322,9 @@ def handle_message(wcf: Wcf, msg: WxMsg, config: dict, dnd_data: dict) -> None:
     
     # 检查是否应该显示该类型的消息
     should_log = msg_config.get(f'type_{msg.type}', False)
+    if not load_controller.log_chatter() and not (msg.type == 1 and msg.content.startswith('.')):
+        # 高负载时不记录普通聊天消息
+        should_log = False
     
     # 记录消息日志
     if should_log:
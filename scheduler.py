@@ -0,0 +1,349 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from queue import Queue, Empty
+from typing import Dict, List, Optional, Set
+from wcferry import Wcf, WxMsg
+from functions import get_user_display_name
+
+logger = logging.getLogger(__name__)
+
+# 时长格式，例如：90s 5m 1h30m 2d
+DURATION_PATTERN = re.compile(r'^(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$')
+# 时刻格式，例如：20:00
+CLOCK_PATTERN = re.compile(r'^(\d{1,2})[:：](\d{2})$')
+
+class Timer:
+    """定时任务记录"""
+
+    __slots__ = ('id', 'receiver', 'sender', 'nickname', 'expire_at', 'text', 'kind')
+
+    def __init__(self, timer_id: int, receiver: str, sender: str, nickname: str,
+                 expire_at: float, text: str, kind: str):
+        self.id = timer_id
+        self.receiver = receiver      # 到期后发送到的群或私聊
+        self.sender = sender
+        self.nickname = nickname
+        self.expire_at = expire_at
+        self.text = text
+        self.kind = kind              # 'timer' 计时 / 'remind' 提醒
+
+class TimingWheel:
+    """分层时间轮，插入和取消均为O(1)，每个刻度只处理当前槽位"""
+
+    def __init__(self, start_tick: int, slot_bits: int = 6, levels: int = 4):
+        self.bits = slot_bits
+        self.size = 1 << slot_bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.current = start_tick
+        self.wheels: List[List[Dict[int, Timer]]] = [
+            [{} for _ in range(self.size)] for _ in range(levels)
+        ]
+        self._locations: Dict[int, Dict[int, Timer]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def add(self, timer: Timer) -> None:
+        """按到期刻度放入对应层级的槽位，已过期的任务在下一刻度触发"""
+        self._place(timer, self.current + 1)
+
+    def _place(self, timer: Timer, earliest: int) -> None:
+        """放入槽位，到期刻度不早于earliest"""
+        expire = max(math.ceil(timer.expire_at), earliest)
+        delay = expire - self.current
+
+        for level in range(self.levels):
+            if delay < 1 << (self.bits * (level + 1)):
+                slot = self.wheels[level][(expire >> (self.bits * level)) & self.mask]
+                break
+        else:
+            # 超出时间轮范围，先放入最高层当前槽位，转动一圈后重新计算位置
+            level = self.levels - 1
+            slot = self.wheels[level][(self.current >> (self.bits * level)) & self.mask]
+
+        slot[timer.id] = timer
+        self._locations[timer.id] = slot
+
+    def remove(self, timer_id: int) -> Optional[Timer]:
+        """取消任务"""
+        slot = self._locations.pop(timer_id, None)
+        if slot is None:
+            return None
+        return slot.pop(timer_id, None)
+
+    def advance(self) -> List[Timer]:
+        """前进一个刻度，返回到期的任务"""
+        self.current += 1
+
+        # 低层转满一圈时，将高层对应槽位的任务下放到低层
+        for level in range(1, self.levels):
+            if self.current & ((1 << (self.bits * level)) - 1):
+                break
+            index = (self.current >> (self.bits * level)) & self.mask
+            cascading = self.wheels[level][index]
+            self.wheels[level][index] = {}
+            for timer in cascading.values():
+                # 恰好在当前刻度到期的任务下放到当前槽位，随后立即触发
+                self._place(timer, self.current)
+
+        index = self.current & self.mask
+        expired = list(self.wheels[0][index].values())
+        self.wheels[0][index] = {}
+        for timer in expired:
+            self._locations.pop(timer.id, None)
+        return expired
+
+class TimerScheduler:
+    """定时任务调度：单个后台线程驱动时间轮，任务持久化到SQLite"""
+
+    def __init__(self, db_path: str, max_per_room: int = 50, max_seconds: int = 30 * 86400):
+        self.db_path = db_path
+        self.max_per_room = max_per_room
+        self.max_seconds = max_seconds
+
+        self.wheel = TimingWheel(int(time.time()))
+        self.fired: "Queue[Timer]" = Queue()
+        self._by_receiver: Dict[str, Set[int]] = {}
+        self._timers: Dict[int, Timer] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS timers ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, receiver TEXT NOT NULL, sender TEXT NOT NULL, "
+            "nickname TEXT NOT NULL, expire_at REAL NOT NULL, text TEXT NOT NULL, kind TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._load()
+
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        """启动时恢复未触发的任务，重启期间到期的任务会立即触发"""
+        rows = self._conn.execute(
+            "SELECT id, receiver, sender, nickname, expire_at, text, kind FROM timers"
+        ).fetchall()
+        for row in rows:
+            self._track(Timer(*row))
+        if rows:
+            logger.info(f"已恢复 {len(rows)} 个定时任务")
+
+    def _track(self, timer: Timer) -> None:
+        """登记任务（调用方需持有锁或处于初始化阶段）"""
+        self._timers[timer.id] = timer
+        self._by_receiver.setdefault(timer.receiver, set()).add(timer.id)
+        self.wheel.add(timer)
+
+    def _untrack(self, timer_id: int) -> Optional[Timer]:
+        """注销任务（调用方需持有锁）"""
+        timer = self._timers.pop(timer_id, None)
+        if timer is None:
+            return None
+        ids = self._by_receiver.get(timer.receiver)
+        if ids is not None:
+            ids.discard(timer_id)
+            if not ids:
+                del self._by_receiver[timer.receiver]
+        self.wheel.remove(timer_id)
+        return timer
+
+    def add(self, receiver: str, sender: str, nickname: str, expire_at: float, text: str, kind: str) -> Timer:
+        """新增任务，超过数量或时长限制时抛出ValueError"""
+        if expire_at - time.time() > self.max_seconds:
+            raise ValueError(f"定时时长不能超过{self.max_seconds // 86400}天")
+
+        with self._lock:
+            if len(self._by_receiver.get(receiver, ())) >= self.max_per_room:
+                raise ValueError(f"当前会话的定时任务已达上限({self.max_per_room}个)")
+
+            cursor = self._conn.execute(
+                "INSERT INTO timers (receiver, sender, nickname, expire_at, text, kind) VALUES (?, ?, ?, ?, ?, ?)",
+                (receiver, sender, nickname, expire_at, text, kind)
+            )
+            self._conn.commit()
+            timer = Timer(cursor.lastrowid, receiver, sender, nickname, expire_at, text, kind)
+            self._track(timer)
+            return timer
+
+    def cancel(self, receiver: str, timer_id: int) -> Optional[Timer]:
+        """取消当前会话中的任务"""
+        with self._lock:
+            timer = self._timers.get(timer_id)
+            if timer is None or timer.receiver != receiver:
+                return None
+            self._untrack(timer_id)
+            self._conn.execute("DELETE FROM timers WHERE id = ?", (timer_id,))
+            self._conn.commit()
+            return timer
+
+    def list(self, receiver: str) -> List[Timer]:
+        """列出当前会话中的任务"""
+        with self._lock:
+            timers = [self._timers[timer_id] for timer_id in self._by_receiver.get(receiver, ())]
+        return sorted(timers, key=lambda timer: timer.expire_at)
+
+    def _run(self) -> None:
+        """时间轮线程：每秒前进一格，落后时追赶到当前时间"""
+        while not self._stopped.wait(max(0.0, self.wheel.current + 1 - time.time())):
+            try:
+                with self._lock:
+                    expired = []
+                    now = int(time.time())
+                    while self.wheel.current < now:
+                        expired.extend(self.wheel.advance())
+                    for timer in expired:
+                        self._untrack(timer.id)
+                    if expired:
+                        self._conn.executemany("DELETE FROM timers WHERE id = ?",
+                                               [(timer.id,) for timer in expired])
+                        self._conn.commit()
+                for timer in expired:
+                    self.fired.put(timer)
+            except Exception as e:
+                logger.error(f"定时任务调度出错: {e}", exc_info=True)
+
+    def close(self) -> None:
+        """停止调度线程"""
+        self._stopped.set()
+        self._thread.join()
+        self._conn.close()
+
+# 全局调度器，启动时根据配置创建
+_scheduler: Optional[TimerScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(config: dict) -> TimerScheduler:
+    """获取全局调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            timer_config = config.get('timer', {})
+            db_file = config.get('files', {}).get('timer_db', 'timers.db')
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            _scheduler = TimerScheduler(
+                os.path.join(current_dir, db_file),
+                max_per_room=timer_config.get('max_per_room', 50),
+                max_seconds=timer_config.get('max_days', 30) * 86400
+            )
+        return _scheduler
+
+def close_scheduler() -> None:
+    """关闭全局调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.close()
+            _scheduler = None
+
+def deliver_fired_timers(wcf: Wcf) -> None:
+    """在主循环中发送已到期的任务，与命令回复共用同一发送路径"""
+    if _scheduler is None:
+        return
+    while True:
+        try:
+            timer = _scheduler.fired.get_nowait()
+        except Empty:
+            return
+        label = "提醒" if timer.kind == 'remind' else "计时结束"
+        reply = f"【{timer.nickname}】{label}：{timer.text}" if timer.text else f"【{timer.nickname}】{label}"
+        try:
+            wcf.send_text(reply, timer.receiver)
+        except Exception as e:
+            logger.error(f"发送定时任务消息出错: {e}", exc_info=True)
+
+def parse_duration(text: str) -> Optional[int]:
+    """解析时长，返回秒数"""
+    match = DURATION_PATTERN.match(text.lower())
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes, seconds = (int(value) if value else 0 for value in match.groups())
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+def parse_clock(text: str) -> Optional[float]:
+    """解析时刻，已过去的时刻视为明天，返回时间戳"""
+    match = CLOCK_PATTERN.match(text)
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+def format_timer_list(timers: List[Timer]) -> str:
+    """格式化任务列表"""
+    if not timers:
+        return "当前没有待触发的定时任务"
+    lines = []
+    for timer in timers:
+        when = datetime.fromtimestamp(timer.expire_at).strftime('%m-%d %H:%M:%S')
+        lines.append(f"#{timer.id} {when} {timer.nickname}: {timer.text or '(无内容)'}")
+    return "待触发的定时任务：\n" + "\n".join(lines)
+
+def _handle_schedule(wcf: Wcf, msg: WxMsg, config: dict, prefix: str, kind: str) -> None:
+    """.timer 与 .remind 的公共处理逻辑"""
+    receiver = msg.roomid or msg.sender
+    parts = msg.content.split(prefix, 1)[1].strip().split(maxsplit=1)
+    scheduler = get_scheduler(config)
+
+    if not parts or parts[0] == 'list':
+        reply = format_timer_list(scheduler.list(receiver))
+    elif parts[0] == 'del':
+        timer_id = parts[1].lstrip('#') if len(parts) > 1 else ''
+        timer = scheduler.cancel(receiver, int(timer_id)) if timer_id.isdigit() else None
+        reply = f"已取消定时任务 #{timer.id}" if timer else "未找到该定时任务，可使用 list 查看"
+    else:
+        when, text = parts[0], parts[1] if len(parts) > 1 else ""
+        seconds = parse_duration(when)
+        expire_at = time.time() + seconds if seconds else parse_clock(when)
+        if not expire_at:
+            reply = f"无法识别的时间: {when}，例如：{prefix} 5m 下一轮 或 {prefix} 20:00 开团"
+        else:
+            nickname = get_user_display_name(wcf, msg.sender, msg.roomid)
+            try:
+                timer = scheduler.add(receiver, msg.sender, nickname, expire_at, text, kind)
+                at = datetime.fromtimestamp(expire_at).strftime('%H:%M:%S')
+                reply = f"【{nickname}】已设置定时任务 #{timer.id}，将于 {at} 触发"
+            except ValueError as e:
+                reply = str(e)
+
+    if msg.roomid:
+        wcf.send_text(reply, msg.roomid)
+    else:
+        wcf.send_text(reply, msg.sender)
+
+def handle_timer_command(wcf: Wcf, msg: WxMsg, config: dict) -> None:
+    """处理.timer命令"""
+    try:
+        _handle_schedule(wcf, msg, config, '.timer', 'timer')
+    except Exception as e:
+        logger.error(f"处理.timer命令出错: {e}", exc_info=True)
+        error_msg = "设置计时器时出错"
+        if msg.roomid:
+            wcf.send_text(error_msg, msg.roomid)
+        else:
+            wcf.send_text(error_msg, msg.sender)
+
+def handle_remind_command(wcf: Wcf, msg: WxMsg, config: dict) -> None:
+    """处理.remind命令"""
+    try:
+        _handle_schedule(wcf, msg, config, '.remind', 'remind')
+    except Exception as e:
+        logger.error(f"处理.remind命令出错: {e}", exc_info=True)
+        error_msg = "设置提醒时出错"
+        if msg.roomid:
+            wcf.send_text(error_msg, msg.roomid)
+        else:
+            wcf.send_text(error_msg, msg.sender)
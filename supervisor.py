@@ -0,0 +1,126 @@
+import logging
+import random
+import time
+from collections import deque
+from queue import Empty
+from typing import Callable, Deque, Optional, Tuple
+from wcferry import Wcf, WxMsg
+
+logger = logging.getLogger(__name__)
+
+class WcfSupervisor:
+    """Wcf连接守护：断线后按指数退避重建连接，重连期间保留未处理的消息"""
+
+    def __init__(self, config: dict, wcf_factory: Callable[[], Wcf] = Wcf):
+        rc_config = config.get('reconnect', {})
+        self.base_delay = rc_config.get('base_delay', 1.0)      # 首次重试等待（秒）
+        self.max_delay = rc_config.get('max_delay', 60.0)       # 单次重试最长等待（秒）
+        self.max_attempts = rc_config.get('max_attempts', 0)    # 最大重试次数，0表示不限
+        self.start_timeout = rc_config.get('start_timeout', 5.0)  # 等待消息接收启动的时间（秒）
+
+        self.wcf_factory = wcf_factory
+        self.wcf: Optional[Wcf] = None
+        # 缓冲区中保存 (消息, 移入缓冲区时的本地单调时钟)
+        self.backlog: Deque[Tuple[WxMsg, float]] = deque(maxlen=rc_config.get('backlog_size', 1000))
+        self.reconnect_count = 0
+
+    def _open(self) -> bool:
+        """创建Wcf实例并启用消息接收"""
+        self.wcf = self.wcf_factory()
+        self.wcf.enable_receiving_msg()
+
+        deadline = time.monotonic() + self.start_timeout
+        while not self.wcf.is_receiving_msg():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _close(self) -> None:
+        """释放当前Wcf实例"""
+        if self.wcf is None:
+            return
+        try:
+            self.wcf.cleanup()
+        except Exception as e:
+            logger.error(f"释放Wcf连接时出错: {e}")
+        self.wcf = None
+
+    def connect(self) -> bool:
+        """建立连接，失败时按带抖动的指数退避重试"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if self._open():
+                    logger.info(f"消息接收功能已启动 (第{attempt}次尝试)")
+                    return True
+                logger.warning(f"等待消息接收功能启动超时 (第{attempt}次尝试)")
+            except Exception as e:
+                logger.error(f"连接Wcf失败 (第{attempt}次尝试): {e}")
+            self._close()
+
+            if self.max_attempts and attempt >= self.max_attempts:
+                return False
+
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            logger.info(f"{delay:.1f}秒后重试连接...")
+            time.sleep(delay)
+
+    def is_healthy(self) -> bool:
+        """检查消息接收是否正常"""
+        try:
+            return self.wcf is not None and self.wcf.is_receiving_msg()
+        except Exception:
+            return False
+
+    def _salvage(self) -> None:
+        """将旧连接中已收到但未处理的消息移入缓冲区"""
+        if self.wcf is None:
+            return
+        salvaged = 0
+        try:
+            while True:
+                msg = self.wcf.get_msg(block=False)
+                if msg:
+                    self.backlog.append((msg, time.monotonic()))
+                    salvaged += 1
+        except Empty:
+            pass
+        except Exception as e:
+            logger.error(f"读取旧连接消息时出错: {e}")
+        if salvaged:
+            logger.info(f"已缓存 {salvaged} 条未处理的消息，重连后继续处理")
+
+    def recover(self) -> bool:
+        """断线后重建连接，内存中的数据和缓存保持不变"""
+        started = time.monotonic()
+        self._salvage()
+        self._close()
+        if not self.connect():
+            return False
+        self.reconnect_count += 1
+        logger.info(f"重新连接成功，耗时 {time.monotonic() - started:.1f}秒，"
+                    f"待处理消息 {len(self.backlog)} 条")
+        return True
+
+    def next_message(self) -> Tuple[Optional[WxMsg], float]:
+        """获取下一条消息及其到达时间（本地单调时钟），优先按顺序处理缓冲区中的消息"""
+        if self.backlog:
+            return self.backlog.popleft()
+        msg = self.wcf.get_msg()
+        return msg, time.monotonic()
+
+    def queue_depth(self) -> int:
+        """待处理的消息数：重连缓冲区加上wcferry内部消息队列"""
+        depth = len(self.backlog)
+        try:
+            depth += self.wcf.msgQ.qsize()
+        except Exception:
+            pass
+        return depth
+
+    def close(self) -> None:
+        """关闭连接"""
+        self._close()
@@ -0,0 +1,339 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from wcferry import WxMsg
+
+logger = logging.getLogger(__name__)
+
+# 轨迹文件格式：文件头 + 若干条记录
+# 记录 = 相对时间(秒) 消息ID 消息类型 消息时间戳 标志位 + 三段带长度前缀的UTF-8字符串(sender, roomid, content)
+TRACE_MAGIC = b'DRTR\x01'
+RECORD_HEADER = struct.Struct('<dQIIB')
+STR_LEN = struct.Struct('<I')
+
+FLAG_SELF = 0x01
+FLAG_GROUP = 0x02
+
+class TraceRecorder:
+    """将收到的消息按到达时间写入二进制轨迹文件，超过大小后自动轮转"""
+
+    def __init__(self, trace_dir: str, max_bytes: int = 16 * 1024 * 1024, max_files: int = 10):
+        self.trace_dir = trace_dir
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._file = None
+        self._written = 0
+        self._start = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.trace_dir, exist_ok=True)
+
+    def _open_new_file(self) -> None:
+        """打开新的轨迹文件并清理过旧的文件"""
+        if self._file:
+            self._file.close()
+
+        file_name = datetime.now().strftime('trace-%Y%m%d-%H%M%S-%f.bin')
+        self._file = open(os.path.join(self.trace_dir, file_name), 'wb')
+        self._file.write(TRACE_MAGIC)
+        self._written = len(TRACE_MAGIC)
+        self._start = time.monotonic()
+
+        traces = sorted(glob.glob(os.path.join(self.trace_dir, 'trace-*.bin')))
+        for old_file in traces[:-self.max_files]:
+            try:
+                os.remove(old_file)
+            except OSError as e:
+                logger.error(f"删除旧轨迹文件出错: {e}")
+
+    def record(self, msg: WxMsg) -> None:
+        """记录一条消息"""
+        try:
+            with self._lock:
+                if self._file is None or self._written >= self.max_bytes:
+                    self._open_new_file()
+
+                flags = (FLAG_SELF if msg.from_self() else 0) | (FLAG_GROUP if msg.from_group() else 0)
+                data = [RECORD_HEADER.pack(
+                    time.monotonic() - self._start, msg.id or 0, msg.type, msg.ts or 0, flags
+                )]
+                for text in (msg.sender, msg.roomid, msg.content):
+                    encoded = (text or '').encode('utf-8')
+                    data.append(STR_LEN.pack(len(encoded)))
+                    data.append(encoded)
+
+                record = b''.join(data)
+                self._file.write(record)
+                # 每条记录立即落盘，进程异常退出时最多丢失正在写入的一条
+                self._file.flush()
+                self._written += len(record)
+        except Exception as e:
+            logger.error(f"记录消息轨迹出错: {e}", exc_info=True)
+
+    def close(self) -> None:
+        """关闭当前轨迹文件"""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+def create_recorder(config: dict) -> Optional[TraceRecorder]:
+    """根据配置创建轨迹记录器，未启用时返回None"""
+    capture_config = config.get('capture', {})
+    if not capture_config.get('enabled', False):
+        return None
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return TraceRecorder(
+        os.path.join(current_dir, capture_config.get('trace_dir', 'traces')),
+        max_bytes=capture_config.get('max_bytes', 16 * 1024 * 1024),
+        max_files=capture_config.get('max_files', 10)
+    )
+
+class ReplayMsg:
+    """回放用的消息对象，提供与 WxMsg 相同的字段"""
+
+    __slots__ = ('id', 'type', 'ts', 'sender', 'roomid', 'content', '_flags',
+                 'sign', 'xml', 'thumb', 'extra')
+
+    def __init__(self, msg_id: int, msg_type: int, ts: int, flags: int, sender: str, roomid: str, content: str):
+        self.id = msg_id
+        self.type = msg_type
+        self.ts = ts
+        self._flags = flags
+        self.sender = sender
+        self.roomid = roomid
+        self.content = content
+        self.sign = self.xml = self.thumb = self.extra = ''
+
+    def from_self(self) -> bool:
+        return bool(self._flags & FLAG_SELF)
+
+    def from_group(self) -> bool:
+        return bool(self._flags & FLAG_GROUP)
+
+def read_trace(path: str) -> Iterator[Tuple[float, ReplayMsg]]:
+    """读取轨迹文件，依次返回 (相对时间, 消息)；末尾不完整的记录会被忽略"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"不是有效的轨迹文件: {path}")
+
+    pos = len(TRACE_MAGIC)
+    while pos < len(data):
+        record = _read_record(data, pos)
+        if record is None:
+            # 进程异常退出时最后一条记录可能只写入了一部分
+            logger.warning(f"轨迹文件末尾有不完整的记录，已忽略: {path} (偏移 {pos})")
+            return
+        offset, msg, pos = record
+        yield offset, msg
+
+def _read_record(data: bytes, pos: int) -> Optional[Tuple[float, ReplayMsg, int]]:
+    """从pos处读取一条记录，返回 (相对时间, 消息, 下一条记录位置)，记录不完整时返回None"""
+    if pos + RECORD_HEADER.size > len(data):
+        return None
+    offset, msg_id, msg_type, ts, flags = RECORD_HEADER.unpack_from(data, pos)
+    pos += RECORD_HEADER.size
+
+    texts = []
+    for _ in range(3):
+        if pos + STR_LEN.size > len(data):
+            return None
+        (length,) = STR_LEN.unpack_from(data, pos)
+        pos += STR_LEN.size
+        if pos + length > len(data):
+            return None
+        texts.append(data[pos:pos + length].decode('utf-8'))
+        pos += length
+
+    return offset, ReplayMsg(msg_id, msg_type, ts, flags, *texts), pos
+
+class StubWcf:
+    """回放用的Wcf替身，记录所有发送的消息"""
+
+    def __init__(self):
+        self.group_users: Dict[str, Dict[str, str]] = {}
+        self.sent: List[Tuple[str, str]] = []
+
+    def send_text(self, msg: str, receiver: str, aters: str = "") -> int:
+        self.sent.append((receiver, msg))
+        return 0
+
+    def get_alias_in_chatroom(self, wxid: str, roomid: str) -> str:
+        return wxid
+
+    def get_contacts(self) -> List[dict]:
+        return []
+
+    def is_receiving_msg(self) -> bool:
+        return True
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """计算已排序数据的百分位数"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def replay(paths: List[str], speed: float = 0.0, output: Optional[str] = None,
+           log_level: str = 'WARNING') -> dict:
+    """回放轨迹文件
+
+    Args:
+        paths: 轨迹文件列表，按顺序回放
+        speed: 回放倍速，1为原速，0表示不等待、尽快回放
+        output: 回复记录输出路径（JSON Lines），用于比较不同版本的行为
+        log_level: 回放期间的日志级别
+    """
+    from main import load_config, load_dnd_data
+    from robot import handle_message
+    from character import close_character_store
+    from scheduler import close_scheduler
+
+    # 模块导入时会初始化日志，需在导入后再调整级别
+    logging.getLogger().setLevel(getattr(logging, log_level.upper()))
+
+    config = load_config()
+    dnd_data = load_dnd_data(config.get('files', {}).get('dnd_data', 'DND5E23_4_2.json'))
+
+    # 角色卡和定时任务写入临时目录，避免回放改动线上数据库
+    temp_dir = tempfile.mkdtemp(prefix='dicerobot-replay-')
+    files_config = config.setdefault('files', {})
+    files_config['character_db'] = os.path.join(temp_dir, 'characters.db')
+    files_config['timer_db'] = os.path.join(temp_dir, 'timers.db')
+
+    wcf = StubWcf()
+    latencies = []
+    out_file = None
+
+    start = time.perf_counter()
+    try:
+        out_file = open(output, 'w', encoding='utf-8') if output else None
+        for path in paths:
+            file_start = time.perf_counter()
+            for offset, msg in read_trace(path):
+                if speed > 0:
+                    delay = offset / speed - (time.perf_counter() - file_start)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                # 以消息ID作为随机种子，使不同版本的掷骰结果可比较
+                random.seed(msg.id)
+                sent_before = len(wcf.sent)
+                t0 = time.perf_counter()
+                handle_message(wcf, msg, config, dnd_data)
+                latencies.append(time.perf_counter() - t0)
+
+                if out_file:
+                    replies = [text for _, text in wcf.sent[sent_before:]]
+                    out_file.write(json.dumps({'id': msg.id, 'content': msg.content, 'replies': replies},
+                                              ensure_ascii=False) + "\n")
+                del wcf.sent[:]
+    finally:
+        if out_file:
+            out_file.close()
+        close_character_store()
+        close_scheduler()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'messages': len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+def diff_replies(path_a: str, path_b: str) -> List[str]:
+    """比较两次回放输出的回复差异"""
+    def load(path: str) -> Dict[int, dict]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return {entry['id']: entry for entry in map(json.loads, f)}
+
+    replies_a, replies_b = load(path_a), load(path_b)
+    diffs = []
+    for msg_id in sorted(set(replies_a) | set(replies_b)):
+        a, b = replies_a.get(msg_id), replies_b.get(msg_id)
+        if a is None or b is None or a['replies'] != b['replies']:
+            content = (a or b)['content']
+            diffs.append(f"[{msg_id}] {content}\n  - {a and a['replies']}\n  + {b and b['replies']}")
+    return diffs
+
+def simulate_backlog(backlog: int, handle_time: float = 0.005, poll_interval: float = 0.1) -> List[int]:
+    """模拟主循环逐条处理积压消息，返回每条消息处理后的降级等级
+
+    使用模拟时钟，不实际等待；用于确认积压时负载控制能够逐级降级。
+    """
+    from main import load_config
+    from load_control import LoadController
+
+    controller = LoadController(clock=lambda: now[0])
+    controller.configure(load_config())
+    # 模拟时钟从距上次等级调整足够久的时刻开始
+    now = [controller.min_dwell]
+
+    levels = []
+    for remaining in range(backlog - 1, -1, -1):
+        now[0] += handle_time
+        controller.observe(0.0, handle_time, remaining)
+        levels.append(controller.level)
+        now[0] += poll_interval
+    return levels
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="消息轨迹回放工具")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    replay_parser = subparsers.add_parser('replay', help="回放轨迹文件")
+    replay_parser.add_argument('traces', nargs='+', help="轨迹文件")
+    replay_parser.add_argument('--speed', type=float, default=0.0, help="回放倍速，0表示尽快回放（默认）")
+    replay_parser.add_argument('--output', help="将每条消息的回复写入该文件，用于版本比较")
+    replay_parser.add_argument('--log-level', default='WARNING', help="回放时的日志级别")
+
+    diff_parser = subparsers.add_parser('diff', help="比较两次回放的回复")
+    diff_parser.add_argument('before')
+    diff_parser.add_argument('after')
+
+    shed_parser = subparsers.add_parser('shed', help="模拟消息积压，检查负载控制是否降级")
+    shed_parser.add_argument('--backlog', type=int, default=500, help="积压的消息数")
+    shed_parser.add_argument('--handle-ms', type=float, default=5.0, help="每条消息的处理耗时（毫秒）")
+    shed_parser.add_argument('--interval-ms', type=float, default=100.0, help="主循环每轮的等待时间（毫秒）")
+
+    args = parser.parse_args()
+
+    if args.action == 'replay':
+        stats = replay(args.traces, speed=args.speed, output=args.output, log_level=args.log_level)
+        print(f"消息数: {stats['messages']}  耗时: {stats['elapsed']:.2f}s  吞吐: {stats['throughput']:.1f} 条/秒")
+        print(f"延迟(ms): p50={stats['p50_ms']:.2f}  p95={stats['p95_ms']:.2f}  "
+              f"p99={stats['p99_ms']:.2f}  max={stats['max_ms']:.2f}")
+    elif args.action == 'shed':
+        from load_control import LEVEL_NAMES, LEVEL_NORMAL
+        levels = simulate_backlog(args.backlog, args.handle_ms / 1000, args.interval_ms / 1000)
+        peak = max(levels, default=LEVEL_NORMAL)
+        print(f"积压 {args.backlog} 条: 最高降级等级 {LEVEL_NAMES[peak]}，处理完毕时 {LEVEL_NAMES[levels[-1]] if levels else '-'}")
+        sys.exit(0 if peak > LEVEL_NORMAL else 1)
+    else:
+        diffs = diff_replies(args.before, args.after)
+        print("\n".join(diffs) if diffs else "回复完全一致")
+        print(f"共 {len(diffs)} 条差异")
+        sys.exit(1 if diffs else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import logging
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import Connection
+from typing import Deque, Dict, List, Optional
+from wcferry import Wcf
+from load_control import load_controller
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内预加载的数据
+_worker_config: dict = {}
+_worker_dnd_data: dict = {}
+
+class WorkerMsg:
+    """工作进程中使用的消息对象，只包含命令处理所需的字段"""
+
+    __slots__ = ('id', 'type', 'sender', 'roomid', 'content')
+
+    def __init__(self, sender: str, roomid: str, content: str):
+        self.id = 0
+        self.type = 1
+        self.sender = sender
+        self.roomid = roomid
+        self.content = content
+
+class CaptureWcf:
+    """工作进程中使用的Wcf替身：昵称由主进程预先查好，回复收集后交回主进程发送"""
+
+    def __init__(self, sender: str, nickname: str):
+        self.group_users: Dict[str, Dict[str, str]] = {}
+        self.replies: List[str] = []
+        self._contacts = [{'wxid': sender, 'name': nickname}]
+        self._nickname = nickname
+
+    def send_text(self, msg: str, receiver: str, aters: str = "") -> int:
+        self.replies.append(msg)
+        return 0
+
+    def get_alias_in_chatroom(self, wxid: str, roomid: str) -> str:
+        return self._nickname
+
+    def get_contacts(self) -> List[dict]:
+        return self._contacts
+
+def _init_worker(config: dict) -> None:
+    """工作进程初始化：预加载骰子引擎、牌堆和规则数据"""
+    global _worker_config, _worker_dnd_data
+    from main import load_dnd_data
+    from functions import load_deck
+    from dice_roller import process_roll_command
+
+    _worker_config = config
+    _worker_dnd_data = load_dnd_data(config.get('files', {}).get('dnd_data', 'DND5E23_4_2.json'))
+    for deck_name in config.get('decks', {}):
+        load_deck(deck_name, config)
+    process_roll_command('d20')
+
+def _run_command(command_name: str, content: str, sender: str, roomid: str, nickname: str,
+                 level: int, dnd_max_chars: int) -> List[str]:
+    """在工作进程中执行命令，返回需要发送的回复；降级等级与主进程提交时保持一致"""
+    from robot import CommandHandler
+    from functions import cache_display_name
+
+    load_controller.level = level
+    load_controller.dnd_max_chars = dnd_max_chars
+    # 跳过昵称查询时命令从缓存取昵称，先写入主进程查好的昵称
+    cache_display_name((sender, roomid), nickname)
+
+    command_info = CommandHandler().commands[command_name]
+    wcf = CaptureWcf(sender, nickname)
+    kwargs = {}
+    if command_info['needs_config']:
+        kwargs['config'] = _worker_config
+    if command_info['needs_dnd_data']:
+        kwargs['dnd_data'] = _worker_dnd_data
+
+    command_info['handler'](wcf, WorkerMsg(sender, roomid, content), **kwargs)
+    return wcf.replies
+
+def _worker_main(conn: Connection, config: dict) -> None:
+    """工作进程主循环：预加载完成后通知主进程，随后逐条执行收到的命令，收到None时退出"""
+    _init_worker(config)
+    conn.send('ready')
+    while True:
+        args = conn.recv()
+        if args is None:
+            break
+        try:
+            conn.send((True, _run_command(*args)))
+        except Exception as e:
+            logger.error(f"工作进程执行命令出错: {e}", exc_info=True)
+            conn.send((False, str(e)))
+
+class Job:
+    """提交到进程池的命令，执行时限从开始执行时计算"""
+
+    __slots__ = ('args', 'receiver', 'timeout', 'deadline')
+
+    def __init__(self, args: tuple, receiver: str, timeout: float):
+        self.args = args
+        self.receiver = receiver
+        self.timeout = timeout
+        self.deadline = 0.0
+
+class Worker:
+    """一个工作进程及其通信管道"""
+
+    __slots__ = ('process', 'conn', 'ready', 'job')
+
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.ready = False          # 预加载完成前不分配命令
+        self.job: Optional[Job] = None
+
+class WorkerPool:
+    """高开销命令的进程池：按估算工作量分流，超时后只结束并替换执行该命令的工作进程"""
+
+    def __init__(self):
+        self.enabled = False
+        self.workers = 2
+        self.heavy_cost = 2000
+        self.heavy_commands = ['.dnd']
+        self.deadline = 5.0
+        self.deadlines: Dict[str, float] = {}
+        self.max_pending = 50
+
+        self.timeout_count = 0
+        self._config: dict = {}
+        self._workers: List[Worker] = []
+        self._queue: Deque[Job] = deque()
+
+    def start(self, config: dict) -> None:
+        """读取配置并启动工作进程"""
+        pool_config = config.get('worker_pool', {})
+        self.enabled = pool_config.get('enabled', self.enabled)
+        self.workers = pool_config.get('workers', self.workers)
+        self.heavy_cost = pool_config.get('heavy_cost', self.heavy_cost)
+        self.heavy_commands = pool_config.get('heavy_commands', self.heavy_commands)
+        self.deadline = pool_config.get('deadline', self.deadline)
+        self.deadlines = pool_config.get('deadlines') or {}
+        self.max_pending = pool_config.get('max_pending', self.max_pending)
+        self._config = config
+
+        if self.enabled:
+            self._workers = [self._spawn() for _ in range(self.workers)]
+            logger.info(f"命令进程池已启动，工作进程数: {self.workers}")
+
+    def _spawn(self) -> Worker:
+        """启动一个工作进程，预加载在子进程中进行，不阻塞主循环"""
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_main, args=(child_conn, self._config), daemon=True)
+        process.start()
+        child_conn.close()
+        return Worker(process, parent_conn)
+
+    def _stop(self, worker: Worker) -> None:
+        """强制结束工作进程"""
+        worker.process.terminate()
+        worker.process.join(timeout=1)
+        worker.conn.close()
+
+    def is_heavy(self, command_name: str, cost: int) -> bool:
+        """判断命令是否需要交给进程池执行"""
+        return bool(self._workers) and (command_name in self.heavy_commands or cost >= self.heavy_cost)
+
+    def submit(self, command_name: str, content: str, sender: str, roomid: str, nickname: str) -> bool:
+        """提交命令，待处理任务过多时返回False"""
+        running = sum(1 for worker in self._workers if worker.job is not None)
+        if running + len(self._queue) >= self.max_pending:
+            return False
+        args = (command_name, content, sender, roomid, nickname,
+                load_controller.level, load_controller.dnd_max_chars)
+        self._queue.append(Job(args, roomid or sender, self.deadlines.get(command_name, self.deadline)))
+        self._dispatch()
+        return True
+
+    def _dispatch(self) -> None:
+        """将排队的命令分配给已就绪的空闲进程，并从此时开始计时"""
+        for worker in self._workers:
+            if not self._queue:
+                return
+            if worker.ready and worker.job is None:
+                job = self._queue.popleft()
+                try:
+                    worker.conn.send(job.args)
+                except (OSError, EOFError) as e:
+                    # 进程已退出或管道已断开：命令放回队首，结束该进程，由poll替换
+                    logger.error(f"向工作进程 {worker.process.pid} 发送命令失败: {e}")
+                    self._queue.appendleft(job)
+                    self._stop(worker)
+                    continue
+                job.deadline = time.monotonic() + job.timeout
+                worker.job = job
+
+    def _reply(self, wcf: Wcf, receiver: str, replies: List[str]) -> None:
+        """发送回复，发送失败只记录日志"""
+        for reply in replies:
+            try:
+                wcf.send_text(reply, receiver)
+            except Exception as e:
+                logger.error(f"发送进程池命令回复出错: {e}")
+
+    def poll(self, wcf: Wcf) -> None:
+        """在主循环中调用：发送已完成命令的回复，替换超时或异常退出的工作进程"""
+        if not self._workers:
+            return
+
+        now = time.monotonic()
+        workers = []
+        for worker in self._workers:
+            try:
+                while worker.conn.poll():
+                    message = worker.conn.recv()
+                    if message == 'ready':
+                        worker.ready = True
+                        continue
+                    ok, payload = message
+                    # 先清除任务再发送回复，发送失败时不会被误判为超时
+                    job, worker.job = worker.job, None
+                    self._reply(wcf, job.receiver, payload if ok else ["命令执行出错，请稍后重试"])
+            except (EOFError, OSError):
+                pass
+
+            job = worker.job
+            if job is not None and now >= job.deadline:
+                self.timeout_count += 1
+                logger.warning(f"命令执行超时，结束并替换工作进程 {worker.process.pid}: {job.args[1][:50]}")
+                self._reply(wcf, job.receiver, [f"命令执行超时已被终止: {job.args[1][:50]}"])
+                self._stop(worker)
+                workers.append(self._spawn())
+            elif not worker.process.is_alive():
+                logger.error(f"工作进程 {worker.process.pid} 异常退出 (退出码 {worker.process.exitcode})")
+                if job is not None:
+                    self._reply(wcf, job.receiver, ["命令执行出错，请稍后重试"])
+                self._stop(worker)
+                # 预加载阶段就退出的进程重建后大概率仍会失败，不再替换
+                if worker.ready:
+                    workers.append(self._spawn())
+            else:
+                workers.append(worker)
+        self._workers = workers
+
+        if not self._workers:
+            logger.error("命令进程池已无可用的工作进程")
+            while self._queue:
+                self._reply(wcf, self._queue.popleft().receiver, ["命令执行出错，请稍后重试"])
+            return
+        self._dispatch()
+
+    def status(self) -> str:
+        """返回进程池状态描述"""
+        if not self._workers:
+            return "命令进程池: 未启用"
+        running = sum(1 for worker in self._workers if worker.job is not None)
+        return (f"命令进程池: {len(self._workers)}个进程, 执行中{running}个命令, 排队{len(self._queue)}个, "
+                f"超时终止{self.timeout_count}个")
+
+    def shutdown(self) -> None:
+        """关闭进程池"""
+        for worker in self._workers:
+            self._stop(worker)
+        self._workers = []
+        self._queue.clear()
+
+worker_pool = WorkerPool()